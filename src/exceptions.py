@@ -6,3 +6,8 @@ class InvalidConfigException(Exception):
 class InvalidSenderAddress(Exception):
     def __init__(self, msg: str) -> None:
         super().__init__(msg)
+
+
+class UnsafeLinkException(Exception):
+    def __init__(self, msg: str) -> None:
+        super().__init__(msg)
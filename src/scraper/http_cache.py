@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, replace
+from logging import getLogger
+from typing import Dict, Optional
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    """
+    The cached result of fetching a single URL. Only the extracted title and
+    text are kept, never the raw response body.
+
+    Parameters:
+        - `url` (required): The normalized URL that was requested
+        - `status` (required): HTTP status code of the response
+        - `fetched_at` (required): Unix time the entry was last fetched or
+        revalidated
+        - `etag` (optional): The `ETag` header, used for revalidation
+        - `last_modified` (optional): The `Last-Modified` header, used for
+        revalidation
+        - `location` (optional): Redirect target, for 3xx responses
+        - `title` (optional): Title of the page
+        - `text` (optional): Visible text of the page
+    """
+
+    url: str
+    status: int
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    location: Optional[str] = None
+    title: str = ""
+    text: str = ""
+
+
+@dataclass
+class HttpCache:
+    """
+    Thread-safe, on-disk cache of scraped pages, fronted by an in-memory
+    LRU of the most recently used entries, so that links repeated within a
+    run rarely touch the disk twice.
+
+    Entries younger than `fresh_for` are served without any network access.
+    Older entries are revalidated with `If-None-Match`/`If-Modified-Since`,
+    and entries that have not been refreshed for `ttl` seconds are evicted.
+
+    Parameters:
+        - `cache_dir` (required): Directory the cache files are written to,
+        created if missing
+        - `fresh_for` (optional): Seconds an entry is used without
+        revalidation. Default: 3600
+        - `ttl` (optional): Seconds after which an entry is evicted.
+        Default: 7 days
+        - `memory_size` (optional): Number of entries kept in memory.
+        Default: 1024
+    """
+
+    cache_dir: str
+    fresh_for: float = 60 * 60
+    ttl: float = 7 * 24 * 60 * 60
+    memory_size: int = 1024
+    _memory: "OrderedDict[str, CacheEntry]" = field(default_factory=OrderedDict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.fresh_for
+
+    def is_expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at >= self.ttl
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """
+        Return the cached entry for `url`, or `None` if there is no entry
+        or it has outlived the TTL (in which case it is also evicted)
+        """
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is not None:
+                self._memory.move_to_end(url)
+        if entry is None:
+            try:
+                with open(self._path(url), encoding="utf-8") as f:
+                    entry = CacheEntry(**json.load(f))
+            except FileNotFoundError:
+                return None
+            except (ValueError, TypeError):
+                logger.warning(f"Discarding unreadable cache entry for {url}")
+                self.delete(url)
+                return None
+        if self.is_expired(entry):
+            self.delete(url)
+            return None
+        self._remember(entry)
+        return entry
+
+    def _remember(self, entry: CacheEntry) -> None:
+        with self._lock:
+            self._memory[entry.url] = entry
+            self._memory.move_to_end(entry.url)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def put(self, entry: CacheEntry) -> None:
+        """
+        Store `entry`, replacing the file atomically. The temporary file is
+        unique across threads and processes sharing the cache directory
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(asdict(entry), f)
+            os.replace(tmp_path, self._path(entry.url))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._remember(entry)
+
+    def refresh(
+        self,
+        entry: CacheEntry,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> CacheEntry:
+        """
+        Store a copy of `entry` revalidated now, after a `304 Not Modified`.
+        The stored entry is shared between threads, so it is never mutated.
+
+        Parameters:
+            - `entry` (required): The cached entry that was revalidated
+            - `etag` (optional): `ETag` sent with the 304, if any
+            - `last_modified` (optional): `Last-Modified` sent with the 304,
+            if any
+
+        Returns:
+            The refreshed entry
+        """
+        refreshed = replace(
+            entry,
+            fetched_at=time.time(),
+            etag=etag or entry.etag,
+            last_modified=last_modified or entry.last_modified,
+        )
+        self.put(refreshed)
+        return refreshed
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self._memory.pop(url, None)
+        try:
+            os.remove(self._path(url))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def validators(entry: CacheEntry) -> Dict[str, str]:
+        """Conditional request headers for revalidating `entry`"""
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def evict_expired(self) -> int:
+        """
+        Remove every entry on disk that has outlived the TTL. Entries are
+        rewritten on every fetch and revalidation, so the file modification
+        time is used rather than parsing each file for `fetched_at`. Temporary
+        files left behind by a crashed process are removed too
+
+        Returns:
+            The number of evicted entries
+        """
+        evicted = 0
+        cutoff = time.time() - self.ttl
+        with os.scandir(self.cache_dir) as files:
+            for file in files:
+                if not file.name.endswith((".json", ".tmp")):
+                    continue
+                try:
+                    if file.stat().st_mtime <= cutoff:
+                        os.remove(file.path)
+                        evicted += file.name.endswith(".json")
+                except FileNotFoundError:
+                    continue
+        return evicted
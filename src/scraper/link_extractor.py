@@ -0,0 +1,162 @@
+import re
+from typing import Dict, Iterable, List
+from urllib.parse import urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup
+
+from src.email_sorter.email_class import Email
+
+# Stops at whitespace, quotes, brackets and the backslashes left behind by the
+# `str(bytes)` decoding in `EmailParser.urlsafe_b64decoder`. Parentheses are
+# allowed, unmatched trailing ones are stripped by `_strip_trailing`
+url_regex = re.compile(r"https?://[^\s<>\"'\\\[\]{}]+", re.IGNORECASE)
+
+# Links that act on a plain GET, e.g. unsubscribing or confirming, and so
+# must never be followed automatically
+action_link_regex = re.compile(
+    r"unsub|opt[-_]?out|confirm|approve|verify|activate|subscription",
+    re.IGNORECASE,
+)
+
+trailing_punctuation = ".,;:!?"
+tracking_query_prefixes = ("utm_",)
+default_ports = {"http": 80, "https": 443}
+
+
+def clean_url(url: str) -> str:
+    """
+    Strip the fragment from a URL, which is never sent to the server. Every
+    other byte is left untouched, since signed tracking redirectors reject
+    links whose query has been altered in any way.
+
+    Parameters:
+        - `url` (required): The absolute http(s) URL to clean
+
+    Returns:
+        The URL that should actually be requested
+    """
+    return urlsplit(url.strip())._replace(fragment="").geturl()
+
+
+def is_action_link(url: str) -> bool:
+    """Whether following `url` may unsubscribe, confirm or approve something"""
+    parts = urlsplit(url)
+    return action_link_regex.search(f"{parts.path}?{parts.query}") is not None
+
+
+def normalize_host(url: str) -> str:
+    """
+    Return the lowercased host of a URL, with its port unless it is the
+    default for the scheme. Userinfo is dropped.
+
+    Raises:
+        - `ValueError`: If the URL has no host or an unparseable port
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if not host:
+        raise ValueError(f"URL {url} has no host")
+    if parts.port and parts.port != default_ports.get(parts.scheme.lower()):
+        host = f"{host}:{parts.port}"
+    return host
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL into the key used for de-duplication and caching, so
+    that trivially different spellings of the same link are only fetched
+    once. The key is never requested itself, use `clean_url` for that.
+
+    On top of `clean_url`, lowercases the scheme and host and drops
+    userinfo, default ports and `utm_*` analytics parameters.
+
+    Parameters:
+        - `url` (required): The absolute http(s) URL to normalize
+
+    Returns:
+        The normalized URL
+
+    Raises:
+        - `ValueError`: If the URL cannot be parsed, e.g. a non-numeric port
+    """
+    parts = urlsplit(clean_url(url))
+    scheme = parts.scheme.lower()
+    host = normalize_host(url)
+    query = "&".join(
+        param
+        for param in parts.query.split("&")
+        if not param.lower().startswith(tracking_query_prefixes)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def _strip_trailing(url: str) -> str:
+    """
+    Strip sentence punctuation and unmatched closing parentheses picked up
+    after a link, e.g. "(see https://x.com/a)." keeps "https://x.com/a"
+    while "https://x.com/Foo_(bar)" is left whole
+    """
+    while True:
+        url = url.rstrip(trailing_punctuation)
+        if url.endswith(")") and url.count(")") > url.count("("):
+            url = url[:-1]
+        else:
+            return url
+
+
+def unique_links(urls: Iterable[str]) -> Dict[str, str]:
+    """
+    De-duplicate links, skipping any that cannot be parsed
+
+    Parameters:
+        - `urls` (required): The raw links to de-duplicate
+
+    Returns:
+        A dictionary of cleaned URLs to request, keyed by normalized URL,
+        in first-seen order
+    """
+    links: Dict[str, str] = {}
+    for url in urls:
+        url = _strip_trailing(url)
+        try:
+            links.setdefault(normalize_url(url), clean_url(url))
+        except ValueError:
+            continue
+    return links
+
+
+def _raw_links(email: Email) -> List[str]:
+    urls: List[str] = []
+    for mime_type, part in email.body.items():
+        if "html" in mime_type and "<" in part:
+            # Search the rendered text rather than the markup, so that
+            # entity-encoded queries (`&amp;`) are not picked up raw
+            soup = BeautifulSoup(part, features="html.parser")
+            urls.extend(str(anchor["href"]) for anchor in soup.find_all(href=True))
+            part = soup.get_text(" ")
+        urls.extend(url_regex.findall(part))
+    return [url for url in urls if url.lower().startswith("http")]
+
+
+def extract_links(email: Email) -> List[str]:
+    """
+    Pull every http(s) link out of the body of a parsed email.
+
+    Plaintext parts are searched with a regex. Parts that still contain
+    markup also have their `href` attributes collected, since the visible
+    anchor text rarely contains the URL itself.
+
+    Parameters:
+        - `email` (required): The parsed `Email` to search
+
+    Returns:
+        The cleaned, de-duplicated links in the order they appear
+    """
+    return list(unique_links(_raw_links(email)).values())
+
+
+def extract_links_from_emails(emails: Iterable[Email]) -> List[str]:
+    """Return the cleaned, de-duplicated links found across all of `emails`"""
+    return list(
+        unique_links(url for email in emails for url in _raw_links(email)).values()
+    )
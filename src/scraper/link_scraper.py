@@ -0,0 +1,504 @@
+import codecs
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import BeautifulSoup, UnicodeDammit
+from requests.adapters import HTTPAdapter
+
+from src.email_sorter.email_class import Email
+from src.exceptions import UnsafeLinkException
+from src.scraper.http_cache import CacheEntry, HttpCache
+from src.scraper.link_extractor import (
+    clean_url,
+    default_ports,
+    extract_links_from_emails,
+    is_action_link,
+    normalize_host,
+    normalize_url,
+    unique_links,
+)
+
+logger = getLogger(__name__)
+
+redirect_statuses = {301, 302, 303, 307, 308}
+text_content_types = ("text/html", "text/plain", "application/xhtml+xml")
+default_retry_after = 60.0
+charset_regex = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+@dataclass
+class ScrapedPage:
+    """
+    The title and text of a page linked to from an email
+
+    Parameters:
+        - `url` (required): The URL found in the email, with any fragment
+        removed
+        - `final_url` (required): The URL the page was served from, after
+        following any redirects
+        - `status` (required): HTTP status of the final response, 0 when the
+        request failed outright
+        - `title` (optional): Title of the page
+        - `text` (optional): Visible text of the page
+        - `from_cache` (optional): Whether every hop was served from the cache
+        - `error` (optional): Description of the failure, if any
+    """
+
+    url: str
+    final_url: str
+    status: int
+    title: str = ""
+    text: str = ""
+    from_cache: bool = False
+    error: Optional[str] = None
+
+
+def header_charset(content_type: str) -> Optional[str]:
+    """
+    Return the charset declared in a `Content-Type` header, or `None` if it
+    is missing or not a known codec
+    """
+    match = charset_regex.search(content_type)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return None
+
+
+def retry_after_seconds(value: Optional[str]) -> float:
+    """
+    Parse a `Retry-After` header, given either in seconds or as an HTTP
+    date. Missing or unparseable values give `default_retry_after`
+    """
+    if not value:
+        return default_retry_after
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default_retry_after
+
+
+def extract_title_and_text(
+    html: bytes, encoding: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Extract the title and visible text of an HTML document, dropping scripts,
+    styles and blank lines in the same way as `EmailParser.html_body_parser`
+
+    Parameters:
+        - `html` (required): The raw bytes of the HTML document to parse
+        - `encoding` (optional): The charset sent in the `Content-Type`
+        header. When missing, the encoding is sniffed from the document
+        itself, e.g. from its `<meta charset>`
+
+    Returns:
+        A `(title, text)` tuple
+    """
+    soup = BeautifulSoup(html, features="html.parser", from_encoding=encoding)
+    title = soup.title.get_text().strip() if soup.title else ""
+
+    for element in soup(["script", "style", "noscript", "template", "head"]):
+        element.extract()
+
+    lines = (line.strip() for line in soup.get_text().splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = "\n".join(chunk for chunk in chunks if chunk)
+
+    return title, text
+
+
+class _HostLimiter:
+    """
+    Per-host politeness limiter. At most `connections` requests are in
+    flight to the host at once, and consecutive requests are started at
+    least `delay` seconds apart.
+    """
+
+    def __init__(self, connections: int, delay: float) -> None:
+        self.delay = delay
+        self.users = 0
+        self._slots = threading.BoundedSemaphore(connections)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._slots:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self.delay
+            time.sleep(start - now)
+            yield
+
+    def back_off(self, seconds: float) -> None:
+        """Hold back every request to the host for the next `seconds`"""
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """Whether dropping the limiter would lose no state"""
+        with self._lock:
+            return self.users == 0 and self._next_start <= time.monotonic()
+
+
+@dataclass
+class LinkScraper:
+    """
+    Concurrently fetches the pages linked to from emails, extracting just
+    their titles and text.
+
+    Email bodies are untrusted, so at every redirect hop links that may act
+    on a GET (unsubscribe, confirm, ...) are refused, as are hosts resolving
+    to private, loopback or link-local addresses unless `allow_private_hosts`
+    is set.
+
+    Links are normalized and de-duplicated before fetching, and every hop of
+    a redirect chain is cached separately. Tracking links that appear in
+    thousands of emails therefore resolve to a single request for the
+    redirect and a single request for the page it points to.
+
+    All requests share one session. Its connection pools are kept for at
+    most `max_open_hosts` hosts, the least recently used being closed, so
+    open sockets stay bounded however many domains a mailbox links to.
+    Should be used as a context manager, so that pooled connections are
+    closed when no longer needed.
+
+    Parameters:
+        - `cache_dir` (optional): Directory for the on-disk HTTP cache.
+        Default: ".scraper_cache" in the working directory
+        - `max_workers` (optional): Number of concurrent fetches. Default: 8
+        - `connections_per_host` (optional): Concurrent connections allowed
+        to a single host. Default: 2
+        - `max_open_hosts` (optional): Number of hosts kept-alive connections
+        are pooled for. Default: 32
+        - `politeness_delay` (optional): Minimum seconds between request
+        starts to a single host. Default: 1.0
+        - `fresh_for` (optional): Seconds a cached page is used without
+        revalidation. Default: 3600
+        - `ttl` (optional): Seconds after which cached pages are evicted.
+        Default: 7 days
+        - `timeout` (optional): Connect and read timeout, in seconds.
+        Default: 10
+        - `max_redirects` (optional): Longest redirect chain followed.
+        Default: 10
+        - `max_bytes` (optional): Response bodies are truncated to this many
+        bytes. Default: 2MB
+        - `memory_cache_size` (optional): Number of cached pages also kept
+        in memory. Default: 1024
+        - `max_backoff` (optional): Longest `Retry-After` honoured after a
+        `429 Too Many Requests`, in seconds. Default: 300
+        - `user_agent` (optional): `User-Agent` header sent with requests
+        - `allow_private_hosts` (optional): Allow requests to private,
+        loopback and link-local addresses. Default: False
+    """
+
+    cache_dir: str = field(
+        default_factory=lambda: os.path.join(os.getcwd(), ".scraper_cache")
+    )
+    max_workers: int = 8
+    connections_per_host: int = 2
+    max_open_hosts: int = 32
+    politeness_delay: float = 1.0
+    fresh_for: float = 60 * 60
+    ttl: float = 7 * 24 * 60 * 60
+    timeout: float = 10
+    max_redirects: int = 10
+    max_bytes: int = 2 * 1024 * 1024
+    memory_cache_size: int = 1024
+    max_backoff: float = 5 * 60
+    user_agent: str = "atlas-link-scraper/0.1"
+    allow_private_hosts: bool = False
+    _hosts: Dict[str, _HostLimiter] = field(default_factory=dict)
+    _url_locks: Dict[str, Tuple[threading.Lock, int]] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_open_hosts,
+            pool_maxsize=self.connections_per_host,
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers["User-Agent"] = self.user_agent
+        self.cache = HttpCache(
+            self.cache_dir,
+            fresh_for=self.fresh_for,
+            ttl=self.ttl,
+            memory_size=self.memory_cache_size,
+        )
+        evicted = self.cache.evict_expired()
+        if evicted:
+            logger.debug(f"Evicted {evicted} expired pages from the cache")
+
+    def __enter__(self) -> "LinkScraper":
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._session.close()
+        with self._lock:
+            self._hosts.clear()
+
+    @contextmanager
+    def _host_slot(self, url: str) -> Iterator[_HostLimiter]:
+        """
+        Wait for a politeness slot on the host of `url`. Limiters are keyed
+        by normalized host, and idle ones are dropped once more than
+        `max_open_hosts` are tracked
+        """
+        host = normalize_host(url)
+        with self._lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                limiter = _HostLimiter(self.connections_per_host, self.politeness_delay)
+                self._hosts[host] = limiter
+            limiter.users += 1
+        try:
+            with limiter.slot():
+                yield limiter
+        finally:
+            with self._lock:
+                limiter.users -= 1
+                if len(self._hosts) > self.max_open_hosts:
+                    for idle_host in [h for h, x in self._hosts.items() if x.idle()]:
+                        del self._hosts[idle_host]
+
+    @contextmanager
+    def _url_lock(self, url: str) -> Iterator[None]:
+        """
+        Hold a lock for `url`, shared by every concurrent caller. The lock is
+        dropped once the last caller is done with it
+        """
+        with self._lock:
+            lock, waiters = self._url_locks.get(url, (threading.Lock(), 0))
+            self._url_locks[url] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, waiters = self._url_locks[url]
+                if waiters == 1:
+                    del self._url_locks[url]
+                else:
+                    self._url_locks[url] = (lock, waiters - 1)
+
+    @staticmethod
+    def _check_link(url: str) -> None:
+        """
+        Refuse non-http(s) links and links that act on a GET
+
+        Raises:
+            - `UnsafeLinkException`: If the link must not be followed
+        """
+        if urlsplit(url).scheme.lower() not in default_ports:
+            raise UnsafeLinkException(f"Refusing non-http(s) link {url}")
+        if is_action_link(url):
+            raise UnsafeLinkException(f"Refusing action link {url}")
+
+    def _check_address(self, url: str) -> None:
+        """
+        Unless `allow_private_hosts` is set, refuse hosts resolving to any
+        private, loopback, link-local or otherwise non-public address
+
+        Raises:
+            - `UnsafeLinkException`: If the host must not be requested
+        """
+        if self.allow_private_hosts:
+            return
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        addresses = socket.getaddrinfo(
+            parts.hostname,
+            parts.port or default_ports[scheme],
+            proto=socket.IPPROTO_TCP,
+        )
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(str(sockaddr[0]).split("%")[0])
+            if not address.is_global or address.is_multicast:
+                raise UnsafeLinkException(
+                    f"Refusing link {url} to non-public address {address}"
+                )
+
+    def _read_body(self, response: requests.Response) -> bytes:
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) >= self.max_bytes:
+                break
+        return bytes(body[: self.max_bytes])
+
+    def _entry_from_response(self, url: str, response: requests.Response) -> CacheEntry:
+        entry = CacheEntry(
+            url=url,
+            status=response.status_code,
+            fetched_at=time.time(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        if response.status_code in redirect_statuses:
+            entry.location = response.headers.get("Location")
+            return entry
+
+        content_type = response.headers.get("Content-Type", "text/html").lower()
+        if response.ok and content_type.startswith(text_content_types):
+            body = self._read_body(response)
+            # Decoding is left to bs4, since requests falls back to
+            # ISO-8859-1 for any text/* response without a charset
+            encoding = header_charset(content_type)
+            if content_type.startswith("text/plain"):
+                dammit = UnicodeDammit(body, [encoding] if encoding else [])
+                entry.text = (dammit.unicode_markup or "").strip()
+            else:
+                entry.title, entry.text = extract_title_and_text(body, encoding)
+        return entry
+
+    def _fetch_one(self, url: str) -> Tuple[CacheEntry, bool]:
+        """
+        Fetch a single URL without following redirects, going through the
+        cache under its normalized key. Concurrent calls for the same key
+        wait for the first one.
+
+        Returns:
+            A `(entry, from_cache)` tuple
+        """
+        key = normalize_url(url)
+        with self._url_lock(key):
+            entry = self.cache.get(key)
+            if entry and self.cache.is_fresh(entry):
+                return entry, True
+
+            self._check_address(url)
+            headers = self.cache.validators(entry) if entry else {}
+            try:
+                with self._host_slot(url) as host:
+                    with self._session.get(
+                        url,
+                        headers=headers,
+                        timeout=self.timeout,
+                        allow_redirects=False,
+                        stream=True,
+                    ) as response:
+                        if entry and response.status_code == 304:
+                            refreshed = self.cache.refresh(
+                                entry,
+                                etag=response.headers.get("ETag"),
+                                last_modified=response.headers.get("Last-Modified"),
+                            )
+                            return refreshed, True
+                        if response.status_code == 429:
+                            delay = retry_after_seconds(
+                                response.headers.get("Retry-After")
+                            )
+                            host.back_off(min(delay, self.max_backoff))
+                        fetched = self._entry_from_response(key, response)
+            except requests.RequestException:
+                if entry:
+                    logger.warning(f"Serving stale cached copy of {url}")
+                    return entry, True
+                raise
+
+            # Rate limits and server errors are transient, so they neither
+            # replace a cached copy nor get cached themselves
+            if fetched.status == 429 or fetched.status >= 500:
+                if entry:
+                    logger.warning(f"Serving stale cached copy of {url}")
+                    return entry, True
+                return fetched, False
+            self.cache.put(fetched)
+            return fetched, False
+
+    def fetch(self, url: str) -> ScrapedPage:
+        """
+        Fetch a single page, following redirects
+
+        Parameters:
+            - `url` (required): The URL to fetch
+
+        Returns:
+            The `ScrapedPage`. Failures are recorded in its `error` attribute
+            rather than raised, so one bad link cannot sink a whole batch
+        """
+        url = clean_url(url)
+        current = url
+        from_cache = True
+        try:
+            for _ in range(self.max_redirects + 1):
+                self._check_link(current)
+                entry, cached = self._fetch_one(current)
+                from_cache = from_cache and cached
+                if not entry.location:
+                    return ScrapedPage(
+                        url=url,
+                        final_url=current,
+                        status=entry.status,
+                        title=entry.title,
+                        text=entry.text,
+                        from_cache=from_cache,
+                    )
+                current = clean_url(urljoin(current, entry.location))
+            error = f"More than {self.max_redirects} redirects"
+        except Exception as e:
+            # Any failure, from the network to a malformed page, only
+            # affects this link
+            error = f"{type(e).__name__}: {e}"
+
+        logger.warning(f"Failed to scrape {url}: {error}")
+        return ScrapedPage(url=url, final_url=current, status=0, error=error)
+
+    def scrape_urls(self, urls: Iterable[str]) -> Dict[str, ScrapedPage]:
+        """
+        Fetch many pages concurrently
+
+        Parameters:
+            - `urls` (required): The URLs to fetch, duplicates are only
+            fetched once. Unparseable URLs and links that act on a GET, such
+            as unsubscribe links, are skipped
+
+        Returns:
+            A dictionary of `ScrapedPage`s keyed by `normalize_url`
+        """
+        links = {
+            key: url
+            for key, url in unique_links(urls).items()
+            if not is_action_link(url)
+        }
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = executor.map(self.fetch, links.values())
+            return dict(zip(links, pages))
+
+    def scrape_emails(self, emails: Iterable[Email]) -> Dict[str, ScrapedPage]:
+        """
+        Fetch every page linked to from `emails`
+
+        Parameters:
+            - `emails` (required): The parsed emails to take links from
+
+        Returns:
+            A dictionary of `ScrapedPage`s keyed by `normalize_url`. Look
+            up the pages belonging to each email by normalizing the links
+            returned by `extract_links`
+        """
+        return self.scrape_urls(extract_links_from_emails(emails))
@@ -0,0 +1,268 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.email_sorter.email_class import Email
+from src.scraper.http_cache import CacheEntry, HttpCache
+from src.scraper.link_extractor import extract_links, normalize_host, normalize_url
+from src.scraper.link_scraper import LinkScraper
+
+page_etag = '"v1"'
+page_html = """
+<html>
+    <head><title> Quarterly results </title><style>p {color: red}</style></head>
+    <body>
+        <p>Revenue is up.</p>
+        <script>track()</script>
+    </body>
+</html>
+"""
+cafe_html = '<html><head><meta charset="utf-8"><title>Café</title></head></html>'
+content_types = {
+    "/cafe": "text/html",
+    "/xhtml": "application/xhtml+xml",
+    "/bogus": "text/html; charset=bogus",
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    hits: dict = {}
+    lock = threading.Lock()
+    failing = False
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        with Handler.lock:
+            Handler.hits[path] = Handler.hits.get(path, 0) + 1
+        if Handler.failing:
+            self.send_response(500)
+            self.end_headers()
+        elif path == "/track":
+            self.send_response(302)
+            self.send_header("Location", "/page")
+            self.end_headers()
+        elif path == "/page" and self.headers.get("If-None-Match") == page_etag:
+            self.send_response(304)
+            self.send_header("Last-Modified", "Mon, 19 Oct 2026 00:00:00 GMT")
+            self.end_headers()
+        elif path == "/signed" and self.path.endswith("?sig=a%20b&k&utm_x=1"):
+            self.send_response(302)
+            self.send_header("Location", "/page")
+            self.end_headers()
+        elif path == "/limited":
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+        elif path in content_types:
+            body = cafe_html.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_types[path])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == "/page":
+            body = page_html.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", page_etag)
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(500)
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def local_scraper(tmp_path, **kwargs) -> LinkScraper:
+    """A scraper allowed to reach the loopback test server"""
+    return LinkScraper(cache_dir=str(tmp_path), allow_private_hosts=True, **kwargs)
+
+
+@pytest.fixture
+def server():
+    Handler.hits = {}
+    Handler.failing = False
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_link_extraction():
+    email = Email(
+        date="",
+        body={
+            "text/plain": "b'See https://Example.com/a?utm_source=x&id=1.\\r\\n'",
+            "text/html": '<a href="https://example.com/a?id=1#top">here</a>',
+        },
+    )
+    assert extract_links(email) == ["https://Example.com/a?utm_source=x&id=1"]
+    assert normalize_url("HTTP://example.com:80") == "http://example.com/"
+
+    # Entity-encoded hrefs and unparseable ports
+    email = Email(
+        date="",
+        body={
+            "text/html": '<a href="https://x.com/c?a=1&amp;b=2">x</a> '
+            "http://example.com:abc/"
+        },
+    )
+    assert extract_links(email) == ["https://x.com/c?a=1&b=2"]
+
+    # Parentheses in paths, and around links in prose
+    email = Email(
+        date="",
+        body={
+            "text/plain": "https://en.wikipedia.org/wiki/Foo_(bar) "
+            "(see https://x.com/a)."
+        },
+    )
+    assert extract_links(email) == [
+        "https://en.wikipedia.org/wiki/Foo_(bar)",
+        "https://x.com/a",
+    ]
+
+
+def test_tracking_links_are_fetched_once(server, tmp_path):
+    emails = [
+        Email(date="", body={"text/plain": f"Read more: {server}/track?id={i % 5}"})
+        for i in range(1000)
+    ]
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        pages = scraper.scrape_emails(emails)
+        assert not scraper._url_locks
+
+    assert len(pages) == 5
+    for page in pages.values():
+        assert page.final_url == f"{server}/page"
+        assert page.title == "Quarterly results"
+        assert page.text == "Revenue is up."
+        assert page.error is None
+    assert Handler.hits == {"/track": 5, "/page": 1}
+
+
+def test_cache_revalidation_and_eviction(server, tmp_path):
+    url = f"{server}/page"
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        assert not scraper.fetch(url).from_cache
+        assert scraper.fetch(url).from_cache
+    assert Handler.hits == {"/page": 1}
+
+    # Stale entries are revalidated with the stored ETag
+    with local_scraper(tmp_path, fresh_for=0) as scraper:
+        page = scraper.fetch(url)
+    assert page.from_cache and page.title == "Quarterly results"
+    assert Handler.hits == {"/page": 2}
+
+    cache = HttpCache(str(tmp_path), memory_size=0)
+    entry = cache.get(url)
+    assert entry and entry.etag == page_etag
+    assert entry.last_modified == "Mon, 19 Oct 2026 00:00:00 GMT"
+    assert not cache._memory
+
+    (tmp_path / "crashed.tmp").write_text("{")
+    cache = HttpCache(str(tmp_path), ttl=0)
+    assert cache.evict_expired() == 1
+    assert not list(tmp_path.iterdir())
+    assert cache.get(url) is None
+
+
+def test_failed_cache_writes_are_cleaned_up(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    with pytest.raises(TypeError):
+        cache.put(CacheEntry(url="x", status=200, fetched_at=0, title=object()))
+    assert not list(tmp_path.iterdir())
+
+
+def test_query_is_requested_unchanged(server, tmp_path):
+    url = f"{server}/signed?sig=a%20b&k&utm_x=1#top"
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        page = scraper.fetch(url)
+    assert page.url == f"{server}/signed?sig=a%20b&k&utm_x=1"
+    assert page.title == "Quarterly results"
+
+
+def test_hosts_are_bounded(server, tmp_path):
+    assert normalize_host("http://user@LOCALHOST:80/") == "localhost"
+    port = server.rsplit(":", 1)[1]
+    hosts = ("127.0.0.1", "localhost", "LOCALHOST")
+    urls = [f"http://{host}:{port}/page" for host in hosts]
+    with local_scraper(tmp_path, politeness_delay=0, max_open_hosts=1) as scraper:
+        for url in urls:
+            assert scraper.fetch(url).title == "Quarterly results"
+        pools = scraper._session.get_adapter(urls[0]).poolmanager.pools
+        assert len(pools) == 1 and len(scraper._hosts) <= 1
+
+
+def test_page_encodings(server, tmp_path):
+    urls = [f"{server}{path}" for path in content_types]
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        pages = scraper.scrape_urls(urls)
+    assert [page.title for page in pages.values()] == ["Café"] * len(urls)
+
+
+def test_rate_limits_back_off(server, tmp_path):
+    url = f"{server}/limited"
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        assert scraper.fetch(url).status == 429
+        start = time.monotonic()
+        assert not scraper.fetch(url).from_cache
+        assert time.monotonic() - start >= 0.9
+    assert Handler.hits == {"/limited": 2}
+
+
+def test_stale_copy_served_on_server_errors(server, tmp_path):
+    url = f"{server}/page"
+    with local_scraper(tmp_path, politeness_delay=0, fresh_for=0) as scraper:
+        assert not scraper.fetch(url).from_cache
+        Handler.failing = True
+        page = scraper.fetch(url)
+    assert page.from_cache and page.status == 200
+    assert page.title == "Quarterly results"
+    assert Handler.hits == {"/page": 2}
+
+
+def test_failures_are_not_cached(server, tmp_path):
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        pages = scraper.scrape_urls([f"{server}/broken", f"{server}/broken"])
+        page = pages[f"{server}/broken"]
+        assert page.status == 500 and not page.text
+        scraper.fetch(f"{server}/broken")
+    assert Handler.hits == {"/broken": 2}
+
+
+def test_unsafe_links_are_refused(server, tmp_path):
+    with LinkScraper(cache_dir=str(tmp_path), politeness_delay=0) as scraper:
+        page = scraper.fetch(f"{server}/page")
+        assert "UnsafeLinkException" in str(page.error)
+
+        # Redirects into private addresses are refused at the hop
+        redirect = "http://public.example/r"
+        scraper.cache.put(
+            CacheEntry(
+                url=redirect,
+                status=302,
+                fetched_at=time.time(),
+                location=f"{server}/page",
+            )
+        )
+        page = scraper.fetch(redirect)
+        assert page.final_url == f"{server}/page" and "non-public" in str(page.error)
+    with local_scraper(tmp_path, politeness_delay=0) as scraper:
+        pages = scraper.scrape_urls([f"{server}/unsubscribe?id=1", f"{server}/page"])
+        assert list(pages) == [f"{server}/page"]
+        assert "action link" in str(scraper.fetch(f"{server}/opt-out").error)
+    assert Handler.hits == {"/page": 1}
+
+
+def test_default_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LinkScraper() as scraper:
+        assert scraper.cache_dir == str(tmp_path / ".scraper_cache")